@@ -2,24 +2,23 @@ import asyncio
 import os
 import logging
 import websockets
-import json
-import requests
-from io import BytesIO
-import wave
-import audioop
-import ffmpeg
-import tempfile
+import struct
 import time
 
+import aiohttp
+import av
+import orjson
+import uvloop
 from pyrtmp import StreamClosedException
 from pyrtmp.flv import FLVFileWriter, FLVMediaType
 from pyrtmp.session_manager import SessionManager
 from pyrtmp.rtmp import SimpleRTMPController, RTMPProtocol, SimpleRTMPServer
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(level=LOG_LEVEL)
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
+logger.setLevel(LOG_LEVEL)
 
 # Set pyrtmp logger to INFO level
 pyrtmp_logger = logging.getLogger('pyrtmp')
@@ -29,44 +28,150 @@ pyrtmp_logger.setLevel(logging.INFO)
 websockets_logger = logging.getLogger('websockets')
 websockets_logger.setLevel(logging.INFO)
 
+# ADTS frame length spans bytes 4-5 of the header (upper 2 bits live in byte 3)
+ADTS_FRAME_LENGTH = struct.Struct('>H')
+
+# FLV audio tag byte -> (sound_format, sound_rate, sound_size, sound_type)
+FLV_AUDIO_TAGS = [((b >> 4) & 0x0F, (b >> 2) & 0x03, (b >> 1) & 0x01, b & 0x01) for b in range(256)]
+
+# FLV sound_rate index -> sample rate in Hz
+FLV_SOUND_RATES = (5512, 11025, 22050, 44100)
+
+# Resolved once for the per-packet handlers
+FLV_AUDIO, FLV_VIDEO, FLV_OBJECT = FLVMediaType.AUDIO, FLVMediaType.VIDEO, FLVMediaType.OBJECT
+
+# Sample rates Gladia accepts for raw PCM input
+GLADIA_SAMPLE_RATES = (8000, 16000, 32000, 44100, 48000)
+WEBHOOK_HEADERS = {'Content-Type': 'application/json'}
+WEBHOOK_TIMEOUT = aiohttp.ClientTimeout(total=5)
+TRANSCRIPTION_WS_INITIAL_BACKOFF = 0.5  # Seconds, doubled after each failed reconnect
+TRANSCRIPTION_WS_MAX_BACKOFF = 10.0
+GLADIA_INITIAL_BACKOFF = 1.0  # Seconds before retrying a failed session start, doubled each failure
+GLADIA_MAX_BACKOFF = 30.0
+GLADIA_STOP_RECORDING = orjson.dumps({"type": "stop_recording"}).decode()
+GLADIA_DRAIN_TIMEOUT = 5.0  # Seconds to wait for the last transcripts after stopping
+PCM_SEND_MS = 500  # Decoded audio gathered per Gladia websocket frame
+FLV_WRITE_QUEUE_SIZE = 256  # Tags waiting for the FLV writer before ingest is held back
+
 class GladiaTranscriber:
-    def __init__(self, api_key, transcription_ws_url="ws://websocket:8000/ws/transcription"):
+    def __init__(self, api_key, http_session, transcription_ws_url="ws://websocket:8000/ws/transcription", max_buffer_size=16384, max_buffer_frames=8):
         self.api_key = api_key
+        self.http_session = http_session
         self.ws = None
         self.transcription_ws = None
         self.session_id = None
-        self.temp_dir = tempfile.mkdtemp()
-        self.chunk_counter = 0
-        self.audio_buffer = []
-        self.buffer_size = 0
-        self.max_buffer_size = 4096  # Buffer up to 4KB of audio before processing
+        self._session_task = None
+        self._session_retry_at = 0.0  # Monotonic time before which a failed session start isn't retried
+        self._session_backoff = GLADIA_INITIAL_BACKOFF
+        self._recv_task = None
+        self._reconnect_task = None
+        self.max_buffer_size = max_buffer_size  # Buffer up to 16KB of audio before processing
+        self.max_buffer_frames = max_buffer_frames  # ...or this many whole frames, whichever comes first
+        # Reused for every flush; holds the encoded audio back to back (ADTS-framed for AAC)
+        self._buf = bytearray(self.max_buffer_size * 2)
+        self._buf_len = 0
+        self._buf_frames = 0
+        self._pcm = bytearray()  # Decoded audio waiting to be sent
         self.aac_config = None  # Store AAC configuration
+        self._adts_template = bytearray([0xFF, 0xF1, 0x40, 0x20, 0x00, 0x1F, 0xFC])  # AAC-LC, 2 channels
+        # One decoder per stream so codec setup is paid once, not per buffer
+        self.decoder = av.CodecContext.create('aac', 'r')
+        self.resampler = av.AudioResampler(format='s16', layout='mono', rate=16000)
+        self.sample_rate = 16000  # Rate of the PCM sent to Gladia
+        self.pcm_source = None  # (format, layout, rate) when the stream carries raw PCM
+        self.pcm_passthrough = False  # Raw PCM Gladia can take as-is
         self.transcription_ws_url = transcription_ws_url
         
     def set_aac_config(self, config):
         self.aac_config = config
+        # Everything but the frame length is fixed for the stream, so build the header once
+        self._adts_template = bytearray([
+            0xFF, 0xF1,  # Sync word, MPEG-4, Layer, Protection absent
+            ((config['profile'] - 1) << 6) | (config['sampling_freq_index'] << 2) | ((config['channels'] >> 2) & 0x01),
+            (config['channels'] & 0x03) << 6,
+            0x00, 0x1F, 0xFC
+        ])
+        
+    def set_sample_rate(self, sample_rate):
+        # Open Gladia at the source rate so the audio is only downmixed, not rate-converted
+        if sample_rate in GLADIA_SAMPLE_RATES:
+            self.sample_rate = sample_rate
+            self.resampler = av.AudioResampler(format='s16', layout='mono', rate=sample_rate)
+        
+    def set_mp3_config(self):
+        self.decoder = av.CodecContext.create('mp3', 'r')
+        
+    def set_pcm_config(self, sample_format, layout, sample_rate):
+        self.decoder = None
+        self.pcm_source = (sample_format, layout, sample_rate)
+        if sample_format == 's16' and layout == 'mono' and sample_rate in GLADIA_SAMPLE_RATES:
+            # Already in a shape Gladia accepts, so skip decoding and resampling entirely
+            self.pcm_passthrough = True
+            self.sample_rate = sample_rate
         
     async def connect_transcription_ws(self):
         if not self.transcription_ws:
             try:
-                self.transcription_ws = await websockets.connect(self.transcription_ws_url)
+                self.transcription_ws = await websockets.connect(self.transcription_ws_url, compression=None)
                 logger.info("Connected to transcription WebSocket")
             except Exception as e:
                 logger.error(f"Failed to connect to transcription WebSocket: {e}")
                 
+    async def _reconnect_transcription_ws(self):
+        # Keep trying, backing off, until the websocket server is reachable again
+        delay = TRANSCRIPTION_WS_INITIAL_BACKOFF
+        while True:
+            await self.connect_transcription_ws()
+            if self.transcription_ws:
+                return
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, TRANSCRIPTION_WS_MAX_BACKOFF)
+            
+    def _schedule_reconnect(self):
+        # Reconnect in the background; only one attempt runs at a time
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = asyncio.create_task(self._reconnect_transcription_ws())
+        
+    async def forward_message(self, message):
+        if not self.transcription_ws:
+            # Never connected, or the last reconnect hasn't succeeded yet
+            logger.warning("Transcription WebSocket not connected, dropping message")
+            self._schedule_reconnect()
+            return
+        try:
+            await self.transcription_ws.send(orjson.dumps(message))
+        except Exception as e:
+            logger.error(f"Failed to send transcription: {e}")
+            self.transcription_ws = None
+            self._schedule_reconnect()
+                
     async def send_transcription(self, text, is_final=False):
-        if self.transcription_ws:
-            try:
-                message = {
-                    "text": text,
-                    "is_final": is_final,
-                    "timestamp": int(time.time() * 1000)
-                }
-                await self.transcription_ws.send(json.dumps(message))
-            except Exception as e:
-                logger.error(f"Failed to send transcription: {e}")
-                # Try to reconnect
-                await self.connect_transcription_ws()
+        message = {
+            "text": text,
+            "is_final": is_final,
+            "timestamp": time.time_ns() // 1_000_000
+        }
+        await self.forward_message(message)
+        
+    def start(self):
+        # Open the Gladia session in the background while the first buffers fill
+        self._session_task = asyncio.create_task(self.start_session())
+        
+    async def _ensure_session(self):
+        # Whether a Gladia session is open; failed starts are retried with backoff
+        if self._session_task is None or (self._session_task.done() and not self.ws):
+            if time.monotonic() < self._session_retry_at:
+                return False
+            self.start()  # Not started yet, or the last attempt failed
+        try:
+            await self._session_task
+        except Exception as e:
+            logger.error(f"Failed to start Gladia session: {e}")
+            self._session_retry_at = time.monotonic() + self._session_backoff
+            self._session_backoff = min(self._session_backoff * 2, GLADIA_MAX_BACKOFF)
+            return False
+        self._session_backoff = GLADIA_INITIAL_BACKOFF
+        return True
         
     async def start_session(self):
         url = "https://api.gladia.io/v2/live"
@@ -77,7 +182,7 @@ class GladiaTranscriber:
         payload = {
             "encoding": "wav/pcm",
             "bit_depth": 16,
-            "sample_rate": 16000,
+            "sample_rate": self.sample_rate,
             "channels": 1,
             "model": "accurate",
             "pre_processing": {
@@ -94,327 +199,383 @@ class GladiaTranscriber:
             }
         }
         
-        response = requests.post(url, json=payload, headers=headers)
-        if response.status_code != 201:
-            raise Exception(f"Failed to start Gladia session: {response.text}")
+        async with self.http_session.post(url, data=orjson.dumps(payload), headers=headers) as response:
+            if response.status != 201:
+                raise Exception(f"Failed to start Gladia session: {await response.text()}")
+            data = await response.json(loads=orjson.loads)
             
-        data = response.json()
         self.session_id = data["id"]
-        self.ws = await websockets.connect(data["url"])
-        
-    async def process_audio(self, audio_data):
-        if not self.ws:
-            await self.start_session()
-        
+        # PCM barely compresses, so skip permessage-deflate; buffer a few frames before send() waits
+        self.ws = await websockets.connect(data["url"], compression=None, write_limit=1 << 20)
+        self._recv_task = asyncio.create_task(self._recv_loop())
+        await self.connect_transcription_ws()
         if not self.transcription_ws:
-            await self.connect_transcription_ws()
+            self._schedule_reconnect()
         
+    async def _recv_loop(self):
+        # Transcripts arrive independently of the audio we send, so read them in the background
+        try:
+            async for response in self.ws:
+                try:
+                    transcript = orjson.loads(response)
+                    
+                    # Handle different types of messages from Gladia
+                    if transcript.get("type") == "transcript":
+                        text = transcript.get("data", {}).get("text", "")
+                        await self.send_transcription(text, is_final=False)
+                    elif transcript.get("type") == "named_entity_recognition":
+                        logger.debug("Named entity recognition received from gladia: %s", transcript)
+                        results = transcript.get("data", {}).get("results", [])
+                        message = {
+                            "type": "named_entity_recognition",
+                            "data": {"results": results},
+                            "timestamp": time.time_ns() // 1_000_000
+                        }
+                        await self.forward_message(message)
+                        logger.info("Named entity recognition: %s", results)
+                    elif transcript.get("type") == "sentiment":
+                        sentiment = transcript.get("data", {}).get("sentiment", {})
+                        message = {
+                            "type": "sentiment",
+                            "data": {"sentiment": sentiment},
+                            "timestamp": time.time_ns() // 1_000_000
+                        }
+                        await self.forward_message(message)
+                        logger.info("Sentiment analysis: %s", sentiment)
+                    elif transcript.get("type") == "post_final_transcript":
+                        text = transcript.get("data", {}).get("text", "")
+                        await self.send_transcription(text, is_final=True)
+                        logger.info("Final transcription: %s", text)
+
+                    else:
+                        logger.debug("Unknown message type received from gladia: %s", transcript.get("type"))
+                except Exception as e:
+                    logger.error(f"Failed to handle Gladia message: {e}", exc_info=True)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        logger.info("Gladia WebSocket closed")
+        # The session is over; the next flush opens a new one through _ensure_session
+        self.ws = None
+        self._session_task = None
+            
+    async def process_audio(self, audio_data):
         # Add to buffer
-        self.audio_buffer.append(audio_data)
-        self.buffer_size += len(audio_data)
+        if self.aac_config:
+            self._append_adts_frame(audio_data)
+        else:
+            self._append(audio_data)
+        self._buf_frames += 1
         
-        # Process if buffer is full
-        if self.buffer_size >= self.max_buffer_size:
-            # Concatenate all buffered audio
-            combined_audio = b''.join(self.audio_buffer)
-            pcm_data = await self._convert_to_pcm(combined_audio)
+        # Process if buffer is full; flushes always fall on frame boundaries
+        if self._buf_len >= self.max_buffer_size or self._buf_frames >= self.max_buffer_frames:
+            with memoryview(self._buf) as view:
+                pcm_data = await self._convert_to_pcm(view[:self._buf_len])
             
             # Clear buffer
-            self.audio_buffer = []
-            self.buffer_size = 0
+            self._buf_len = 0
+            self._buf_frames = 0
             
+            # Send in PCM_SEND_MS frames rather than one per flush to cut per-frame overhead
             if pcm_data:
-                await self.ws.send(pcm_data)
-                response = await self.ws.recv()
-                transcript = json.loads(response)
-                
-                # Handle different types of messages from Gladia
-                if transcript.get("type") == "transcript":
-                    print("Transcript type received from gladia")
-                    text = transcript.get("data", {}).get("text", "")
-                    await self.send_transcription(text, is_final=False)
-                elif transcript.get("type") == "named_entity_recognition":
-                    print("Named entity recognition received from gladia")
-                    print(f"Transcript: {transcript}")
-                    results = transcript.get("data", {}).get("results", [])
-                    message = {
-                        "type": "named_entity_recognition",
-                        "data": {"results": results},
-                        "timestamp": int(time.time() * 1000)
-                    }
-                    print("Sending named entity recognition")
-                    await self.transcription_ws.send(json.dumps(message))
-                    logger.info(f"Named entity recognition: {results}")
-                elif transcript.get("type") == "sentiment":
-                    print("Sentiment analysis received from gladia")
-                    sentiment = transcript.get("data", {}).get("sentiment", {})
-                    message = {
-                        "type": "sentiment",
-                        "data": {"sentiment": sentiment},
-                        "timestamp": int(time.time() * 1000)
-                    }
-                    await self.transcription_ws.send(json.dumps(message))
-                    logger.info(f"Sentiment analysis: {sentiment}")
-                elif transcript.get("type") == "post_final_transcript":
-                    text = transcript.get("data", {}).get("text", "")
-                    await self.send_transcription(text, is_final=True)
-                    logger.info(f"Final transcription: {text}")
-
-                else:
-                    print(f"Unknown message type received from gladia: {transcript.get('type')}")
-
-               
-            # Add a small delay to avoid overwhelming the system
-            await asyncio.sleep(0.01)  # 10ms delay
+                self._pcm += pcm_data
+                if len(self._pcm) >= self.sample_rate * 2 * PCM_SEND_MS // 1000:
+                    await self._send_pcm()
+                    
+    async def _send_pcm(self):
+        if not await self._ensure_session():
+            # Drop audio Gladia can't take rather than piling it up until a session opens
+            self._pcm.clear()
+            return
+        pcm, self._pcm = self._pcm, bytearray()
+        await self.ws.send(pcm)
             
+    def _reserve(self, size):
+        start = self._buf_len
+        end = start + size
+        if end > len(self._buf):
+            self._buf.extend(bytes(end - len(self._buf)))
+        self._buf_len = end
+        return start, end
+        
+    def _append(self, audio_data):
+        start, end = self._reserve(len(audio_data))
+        self._buf[start:end] = audio_data
+        
+    def _append_adts_frame(self, audio_data):
+        # Give every AAC packet its own ADTS header so the decoder's parser can frame it
+        frame_len = len(audio_data) + 7  # ADTS header size
+        start, end = self._reserve(frame_len)
+        self._buf[start:start + 7] = self._adts_template
+        self._buf[start + 3] |= (frame_len >> 11) & 0x03
+        ADTS_FRAME_LENGTH.pack_into(self._buf, start + 4, ((frame_len & 0x7FF) << 5) | 0x1F)
+        self._buf[start + 7:end] = audio_data
+        
+    def _pcm_frames(self, pcm_data):
+        sample_format, layout, sample_rate = self.pcm_source
+        sample_width = (1 if sample_format == 'u8' else 2) * (2 if layout == 'stereo' else 1)
+        frame = av.AudioFrame(format=sample_format, layout=layout, samples=len(pcm_data) // sample_width)
+        frame.sample_rate = sample_rate
+        frame.planes[0].update(pcm_data[:frame.samples * sample_width])
+        yield frame
+        
     async def _convert_to_pcm(self, audio_data):
+        if self.pcm_passthrough:
+            return bytes(audio_data)
+        # Decoding holds the codec for milliseconds per buffer; keep it off the event loop
+        return await asyncio.to_thread(self._decode_to_pcm, audio_data)
+        
+    def _decode_to_pcm(self, audio_data):
         try:
-            self.chunk_counter += 1
-            aac_path = os.path.join(self.temp_dir, f"chunk_{self.chunk_counter}.aac")
-            pcm_path = os.path.join(self.temp_dir, f"chunk_{self.chunk_counter}.pcm")
-            wav_path = os.path.join(self.temp_dir, f"chunk_{self.chunk_counter}.wav")
-            
-            # Write AAC data with ADTS header for each frame
-            with open(aac_path, 'wb') as f:
-                # Write AAC config if available
-                if self.aac_config:
-                    # ADTS header for config
-                    config_header = bytearray([0xFF, 0xF1])  # Sync word, MPEG-4, Layer, Protection absent
-                    config_header.append(((self.aac_config['profile'] - 1) << 6) | (self.aac_config['sampling_freq_index'] << 2) | ((self.aac_config['channels'] >> 2) & 0x01))
-                    config_header.append(((self.aac_config['channels'] & 0x03) << 6) | ((9) >> 11))  # 9 is length of config
-                    config_header.append((9 >> 3) & 0xFF)
-                    config_header.append(((9 & 0x07) << 5) | 0x1F)
-                    config_header.append(0xFC)
-                    f.write(config_header)
-                    f.write(self.aac_config['config'])
-                
-                # Write audio frame with ADTS header
-                frame_len = len(audio_data) + 7  # ADTS header size
-                header = bytearray([0xFF, 0xF1])  # Sync word, MPEG-4, Layer, Protection absent
-                if self.aac_config:
-                    header.append(((self.aac_config['profile'] - 1) << 6) | (self.aac_config['sampling_freq_index'] << 2) | ((self.aac_config['channels'] >> 2) & 0x01))
-                    header.append(((self.aac_config['channels'] & 0x03) << 6) | ((frame_len) >> 11))
-                else:
-                    header.append(0x40)  # AAC-LC, 44.1kHz
-                    header.append(0x20 | ((frame_len) >> 11))  # 2 channels
-                header.append((frame_len >> 3) & 0xFF)
-                header.append(((frame_len & 0x07) << 5) | 0x1F)
-                header.append(0xFC)
-                f.write(header)
-                f.write(audio_data)
-            
-            # First convert to WAV to ensure proper format
-            process = await asyncio.create_subprocess_exec(
-                'ffmpeg',
-                '-y',
-                '-f', 'aac',
-                '-acodec', 'aac',
-                '-i', aac_path,
-                '-acodec', 'pcm_s16le',
-                '-f', 'wav',
-                '-ac', '1',
-                '-ar', '16000',
-                wav_path,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            
-            stdout, stderr = await process.communicate()
-            
-            if process.returncode != 0:
-                logger.error(f"FFmpeg conversion to WAV failed: {stderr.decode()}")
-                return None
-            
-            # Then convert WAV to raw PCM
-            process = await asyncio.create_subprocess_exec(
-                'ffmpeg',
-                '-y',
-                '-f', 'wav',
-                '-i', wav_path,
-                '-f', 's16le',
-                '-acodec', 'pcm_s16le',
-                pcm_path,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            
-            stdout, stderr = await process.communicate()
+            # Decode (raw PCM only needs resampling) to mono s16le PCM at self.sample_rate
+            if self.pcm_source:
+                frames = self._pcm_frames(audio_data)
+            else:
+                frames = (frame for packet in self.decoder.parse(audio_data) for frame in self.decoder.decode(packet))
+            pcm_chunks = []
+            for frame in frames:
+                for out in self.resampler.resample(frame):
+                    # Plane buffers may be padded, only keep the actual samples
+                    pcm_chunks.append(bytes(out.planes[0])[:out.samples * 2])
             
-            if process.returncode != 0:
-                logger.error(f"FFmpeg conversion to PCM failed: {stderr.decode()}")
-                return None
-            
-            try:
-                with open(pcm_path, 'rb') as f:
-                    pcm_data = f.read()
-                return pcm_data if len(pcm_data) > 0 else None
-            except FileNotFoundError:
-                logger.error("PCM file not created")
-                return None
-            finally:
-                # Cleanup temporary files
-                for path in [aac_path, wav_path, pcm_path]:
-                    try:
-                        if os.path.exists(path):
-                            os.remove(path)
-                    except Exception as e:
-                        logger.warning(f"Failed to cleanup temp file {path}: {e}")
+            pcm_data = b''.join(pcm_chunks)
+            return pcm_data if len(pcm_data) > 0 else None
             
         except Exception as e:
             logger.error(f"Failed to convert audio: {e}", exc_info=True)
             return None
         
     async def close(self):
-        # Process any remaining buffered audio
-        if self.audio_buffer:
-            combined_audio = b''.join(self.audio_buffer)
-            pcm_data = await self._convert_to_pcm(combined_audio)
-            if pcm_data and self.ws:
-                await self.ws.send(pcm_data)
-                response = await self.ws.recv()
-                transcript = json.loads(response)
-                if "transcription" in transcript:
-                    text = transcript["transcription"]
-                    await self.send_transcription(text, is_final=True)
-                    logger.info(f"Final transcription: {text}")
-        
-        if self.ws:
-            await self.ws.close()
-        if self.transcription_ws:
-            await self.transcription_ws.close()
         try:
-            os.rmdir(self.temp_dir)
-        except:
-            pass
+            # Process any remaining buffered audio
+            if self._buf_len:
+                with memoryview(self._buf) as view:
+                    pcm_data = await self._convert_to_pcm(view[:self._buf_len])
+                self._buf_len = 0
+                self._buf_frames = 0
+                if pcm_data:
+                    self._pcm += pcm_data
+            if self._pcm and self.ws:
+                try:
+                    await self._send_pcm()
+                except websockets.exceptions.ConnectionClosed as e:
+                    logger.warning(f"Gladia connection closed before the last audio was sent: {e}")
+            
+            if self.ws and self._recv_task:
+                # Ask Gladia to finish up; it sends the final transcripts, then closes the socket
+                try:
+                    await self.ws.send(GLADIA_STOP_RECORDING)
+                    await asyncio.wait_for(self._recv_task, GLADIA_DRAIN_TIMEOUT)
+                except asyncio.TimeoutError:
+                    logger.warning("Timed out waiting for final transcripts from Gladia")
+                except Exception as e:
+                    logger.error(f"Failed to stop Gladia session: {e}")
+        finally:
+            if self._session_task:
+                self._session_task.cancel()
+            if self._recv_task:
+                self._recv_task.cancel()
+            if self._reconnect_task:
+                self._reconnect_task.cancel()
+            # Both close handshakes can run at once
+            await asyncio.gather(*(ws.close() for ws in (self.ws, self.transcription_ws) if ws))
 
 class RTMP2FLVController(SimpleRTMPController):
 
-    def __init__(self, output_directory: str, gladia_api_key: str, webhook_url: str = "http://websocket:8000/webhook", transcription_ws_url: str = "ws://websocket:8000/ws/transcription"):
+    def __init__(self, output_directory: str, gladia_api_key: str, http_session: aiohttp.ClientSession, webhook_url: str = "http://websocket:8000/webhook", transcription_ws_url: str = "ws://websocket:8000/ws/transcription"):
         self.output_directory = output_directory
+        self.http_session = http_session
         self.transcriber = None  # Initialize later when we have audio config
         self.gladia_api_key = gladia_api_key
         self.webhook_url = webhook_url
         self.transcription_ws_url = transcription_ws_url
         self.audio_config = None
+        self._payload_offset = None  # Where audio starts in each packet, once the format is known
+        self.audio_sample_rate = None
+        self._webhook_tasks = set()  # Keep in-flight webhook calls referenced until done
+        self._flv_queue = None
+        self._flv_writer_task = None
         super().__init__()
 
+    def _create_transcriber(self):
+        transcriber = GladiaTranscriber(self.gladia_api_key, self.http_session, self.transcription_ws_url)
+        if self.audio_sample_rate:
+            transcriber.set_sample_rate(self.audio_sample_rate)
+        return transcriber
+
     async def on_ns_publish(self, session, message) -> None:
         publishing_name = message.publishing_name
         file_path = os.path.join(self.output_directory, f"{publishing_name}.flv")
         session.state = FLVFileWriter(output=file_path)
+        # Disk writes happen off the event loop so a slow disk can't stall ingest
+        self._flv_queue = asyncio.Queue(maxsize=FLV_WRITE_QUEUE_SIZE)
+        self._flv_writer_task = asyncio.create_task(self._flv_writer(session.state, self._flv_queue))
         
-        # Call webhook
-        try:
-            webhook_data = {
-                "event_type": "stream_start",
-                "stream_key": publishing_name,
-                "metadata": {
-                    "file_path": file_path,
-                    "timestamp": message.timestamp if hasattr(message, 'timestamp') else None
-                }
+        # Call webhook in the background so publishing isn't held up by it
+        webhook_data = {
+            "event_type": "stream_start",
+            "stream_key": publishing_name,
+            "metadata": {
+                "file_path": file_path,
+                "timestamp": message.timestamp if hasattr(message, 'timestamp') else None
             }
-            response = await asyncio.get_event_loop().run_in_executor(
-                None,
-                lambda: requests.post(self.webhook_url, json=webhook_data)
-            )
-            if response.status_code != 200:
-                logger.error(f"Failed to call webhook: {response.text}")
-        except Exception as e:
-            logger.error(f"Failed to call webhook: {e}")
+        }
+        task = asyncio.create_task(self._call_webhook(orjson.dumps(webhook_data)))
+        self._webhook_tasks.add(task)
+        task.add_done_callback(self._webhook_tasks.discard)
         
         await super().on_ns_publish(session, message)
+        
+    async def _call_webhook(self, body):
+        try:
+            async with self.http_session.post(self.webhook_url, data=body, headers=WEBHOOK_HEADERS, timeout=WEBHOOK_TIMEOUT) as response:
+                if response.status != 200:
+                    logger.error(f"Failed to call webhook: {await response.text()}")
+        except Exception as e:
+            logger.error(f"Failed to call webhook: {e}")
 
     async def on_metadata(self, session, message) -> None:
-        session.state.write(0, message.to_raw_meta(), FLVMediaType.OBJECT)
+        await self._flv_queue.put((0, message.to_raw_meta(), FLV_OBJECT))
         # Try to get audio configuration from metadata
         try:
-            # Parse raw metadata
-            meta = message.payload.decode('utf-8')
+            # pyrtmp has already decoded the AMF0 onMetaData object
+            meta = message.meta or {}
             
             # Extract audio configuration if available
-            if '@setDataFrame' in meta:
-                if 'audiocodecid' in meta:
-                    logger.info(f"Audio codec ID found in metadata")
-                if 'audiosamplerate' in meta:
-                    logger.info(f"Audio sample rate found in metadata")
+            if meta.get('audiosamplerate'):
+                self.audio_sample_rate = int(meta['audiosamplerate'])
+                logger.info(f"Audio sample rate from metadata: {self.audio_sample_rate}")
         except Exception as e:
             logger.error(f"Failed to parse metadata: {e}")
         await super().on_metadata(session, message)
 
     async def on_video_message(self, session, message) -> None:
-        session.state.write(message.timestamp, message.payload, FLVMediaType.VIDEO)
+        await self._flv_queue.put((message.timestamp, message.payload, FLV_VIDEO))
         await super().on_video_message(session, message)
 
     async def on_audio_message(self, session, message) -> None:
-        session.state.write(message.timestamp, message.payload, FLVMediaType.AUDIO)
+        await self._flv_queue.put((message.timestamp, message.payload, FLV_AUDIO))
         
         try:
-            # First byte of FLV audio tag contains audio format info
-            audio_tag = message.payload[0]
-            sound_format = (audio_tag >> 4) & 0x0F  # First 4 bits
-            sound_rate = (audio_tag >> 2) & 0x03    # Next 2 bits
-            sound_size = (audio_tag >> 1) & 0x01    # Next 1 bit
-            sound_type = audio_tag & 0x01           # Last bit
-            
-            # Log audio format details for debugging
-            if not self.audio_config:
-                logger.debug(f"Audio format: {sound_format}, rate: {sound_rate}, size: {sound_size}, type: {sound_type}")
-            # For AAC (sound_format == 10), second byte is AACPacketType
-            if sound_format == 10:  # AAC
-                aac_packet_type = message.payload[1]
-                if aac_packet_type == 0 and not self.audio_config:  # AAC sequence header
-                    # Extract AAC configuration
-                    aac_config = message.payload[2:]
-                    logger.info(f"AAC config received: {aac_config.hex()}")
-                    
-                    # Parse AAC config
-                    aac_profile = (aac_config[0] >> 3) & 0x1F
-                    aac_sampling_freq = ((aac_config[0] & 0x07) << 1) | ((aac_config[1] >> 7) & 0x01)
-                    aac_channels = (aac_config[1] >> 3) & 0x0F
-                    
-                    logger.info(f"AAC Profile: {aac_profile}, Sampling Freq Index: {aac_sampling_freq}, Channels: {aac_channels}")
-                    
-                    self.audio_config = {
-                        'format': 'aac',
-                        'profile': aac_profile,
-                        'sampling_freq_index': aac_sampling_freq,
-                        'channels': aac_channels,
-                        'rate_idx': sound_rate,
-                        'config': aac_config
-                    }
-                    # Initialize transcriber now that we have config
-                    self.transcriber = GladiaTranscriber(self.gladia_api_key, self.transcription_ws_url)
-                    self.transcriber.set_aac_config(self.audio_config)
-                    return  # Don't process AAC sequence header
-                
-                # Only process AAC raw packets (type 1)
-                if aac_packet_type != 1:
-                    return
-                
-                # Skip AAC packet type byte for raw packets
-                audio_data = message.payload[2:]
+            if self._payload_offset:
+                # The format is fixed once configured; for AAC only raw packets (type 1) carry audio
+                if self._payload_offset == 1 or message.payload[1] == 1:
+                    await self._transcribe(memoryview(message.payload)[self._payload_offset:])
             else:
-                audio_data = message.payload[1:]  # Skip FLV audio tag
-                
-            # Send audio to Gladia for transcription
-            if self.transcriber:
-                try:
-                    await self.transcriber.process_audio(audio_data)
-                except Exception as e:
-                    logger.error(f"Failed to transcribe audio: {e}")
-            
+                audio_data = self._configure_audio(message.payload)
+                if audio_data is not None:
+                    await self._transcribe(audio_data)
         except Exception as e:
             logger.error(f"Failed to process audio message: {e}", exc_info=True)
         
         await super().on_audio_message(session, message)
+        
+    async def _transcribe(self, audio_data):
+        # Send audio to Gladia for transcription
+        try:
+            await self.transcriber.process_audio(audio_data)
+        except Exception as e:
+            logger.error(f"Failed to transcribe audio: {e}")
+            
+    def _configure_audio(self, payload):
+        # First byte of FLV audio tag contains audio format info
+        sound_format, sound_rate, sound_size, sound_type = FLV_AUDIO_TAGS[payload[0]]
+        
+        # Log audio format details for debugging
+        # (runs per frame until configured, so skip building the message unless debug is on)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Audio format: %d, rate: %d, size: %d, type: %d", sound_format, sound_rate, sound_size, sound_type)
+        # For AAC (sound_format == 10), second byte is AACPacketType
+        if sound_format == 10:  # AAC
+            if payload[1] != 0:  # Wait for the AAC sequence header
+                return None
+            # Extract AAC configuration
+            aac_config = payload[2:]
+            logger.info(f"AAC config received: {aac_config.hex()}")
+            
+            # Parse AAC config
+            aac_profile = (aac_config[0] >> 3) & 0x1F
+            aac_sampling_freq = ((aac_config[0] & 0x07) << 1) | ((aac_config[1] >> 7) & 0x01)
+            aac_channels = (aac_config[1] >> 3) & 0x0F
+            
+            logger.info(f"AAC Profile: {aac_profile}, Sampling Freq Index: {aac_sampling_freq}, Channels: {aac_channels}")
+            
+            self.audio_config = {
+                'format': 'aac',
+                'profile': aac_profile,
+                'sampling_freq_index': aac_sampling_freq,
+                'channels': aac_channels,
+                'rate_idx': sound_rate,
+                'config': aac_config
+            }
+            # Initialize transcriber now that we have config
+            self.transcriber = self._create_transcriber()
+            self.transcriber.set_aac_config(self.audio_config)
+            self.transcriber.start()
+            self._payload_offset = 2  # Skip FLV audio tag and AAC packet type
+            return None  # Don't process AAC sequence header
+        
+        # Non-AAC formats need no sequence header, so configure from the first packet
+        if sound_format == 2:  # MP3
+            self.transcriber = self._create_transcriber()
+            self.transcriber.set_mp3_config()
+        elif sound_format == 3:  # Linear PCM, little endian
+            self.transcriber = self._create_transcriber()
+            self.transcriber.set_pcm_config(
+                's16' if sound_size else 'u8',
+                'stereo' if sound_type else 'mono',
+                FLV_SOUND_RATES[sound_rate]
+            )
+        else:
+            return None  # No decoder for this format
+        self.audio_config = {
+            'format': sound_format,
+            'rate_idx': sound_rate,
+            'size': sound_size,
+            'type': sound_type
+        }
+        self.transcriber.start()
+        self._payload_offset = 1  # Skip FLV audio tag
+        return memoryview(payload)[1:]  # A view, it is copied once into the buffer
+
+    async def _flv_writer(self, writer, queue):
+        while True:
+            # Write whatever has queued up in one thread hop
+            tags = [await queue.get()]
+            while not queue.empty():
+                tags.append(queue.get_nowait())
+            done = tags[-1] is None  # Sentinel from on_stream_closed
+            if done:
+                tags.pop()
+            try:
+                await asyncio.to_thread(self._write_flv_tags, writer, tags)
+            except Exception as e:
+                logger.error(f"Failed to write FLV: {e}")
+            if done:
+                return
+                
+    @staticmethod
+    def _write_flv_tags(writer, tags):
+        for timestamp, payload, media_type in tags:
+            writer.write(timestamp, payload, media_type)
 
     async def on_stream_closed(self, session: SessionManager, exception: StreamClosedException) -> None:
-        # Only close if state is FLVFileWriter
-        if hasattr(session.state, 'close'):
-            session.state.close()
+        # The recording and the transcriber shut down independently, so do both at once
+        closing = [self._close_flv(session)]
         if self.transcriber:
-            await self.transcriber.close()
+            closing.append(self.transcriber.close())
+        for result in await asyncio.gather(*closing, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to clean up closed stream: {result}", exc_info=result)
         await super().on_stream_closed(session, exception)
+        
+    async def _close_flv(self, session):
+        # Let queued tags reach the file before closing it
+        if self._flv_writer_task:
+            await self._flv_queue.put(None)
+            await self._flv_writer_task
+        # Only close if state is FLVFileWriter
+        if hasattr(session.state, 'close'):
+            await asyncio.to_thread(session.state.close)
 
 
 class SimpleServer(SimpleRTMPServer):
@@ -423,14 +584,18 @@ class SimpleServer(SimpleRTMPServer):
         self.output_directory = output_directory
         self.gladia_api_key = gladia_api_key
         self.webhook_url = webhook_url
+        self.http_session = None
         super().__init__()
 
     async def create(self, host: str, port: int):
         loop = asyncio.get_event_loop()
+        # Shared across all connections so HTTP keep-alive survives between streams
+        self.http_session = aiohttp.ClientSession()
         self.server = await loop.create_server(
             lambda: RTMPProtocol(controller=RTMP2FLVController(
                 self.output_directory,
                 self.gladia_api_key,
+                self.http_session,
                 self.webhook_url
             )),
             host=host,
@@ -452,9 +617,12 @@ async def main():
         webhook_url=webhook_url
     )
     await server.create(host='0.0.0.0', port=1935)
-    await server.start()
-    await server.wait_closed()
+    try:
+        await server.start()
+        await server.wait_closed()
+    finally:
+        await server.http_session.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    uvloop.run(main())
\ No newline at end of file
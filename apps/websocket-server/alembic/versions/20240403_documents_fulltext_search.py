@@ -0,0 +1,35 @@
+"""add full-text search column to documents
+
+Revision ID: 20240403_documents_fulltext_search
+Revises: 20240402_documents_user_created_index
+Create Date: 2024-04-03 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '20240403_documents_fulltext_search'
+down_revision = '20240402_documents_user_created_index'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'documents',
+        sa.Column(
+            'fulltext_tsv',
+            postgresql.TSVECTOR(),
+            sa.Computed("to_tsvector('english', coalesce(fulltext_content, ''))", persisted=True),
+            nullable=True
+        )
+    )
+    op.create_index('ix_documents_fulltext_tsv', 'documents', ['fulltext_tsv'], postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_documents_fulltext_tsv', table_name='documents')
+    op.drop_column('documents', 'fulltext_tsv')
@@ -0,0 +1,30 @@
+"""add chunk embeddings cache table
+
+Revision ID: 20240404_add_chunk_embeddings_table
+Revises: 20240403_documents_fulltext_search
+Create Date: 2024-04-04 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '20240404_add_chunk_embeddings_table'
+down_revision = '20240403_documents_fulltext_search'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'chunk_embeddings',
+        sa.Column('hash', sa.String(32), nullable=False),
+        sa.Column('embedding', sa.LargeBinary(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('hash')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('chunk_embeddings')
@@ -1,50 +1,159 @@
 import aiohttp
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import os
-import json
+import orjson
 import logging
 from typing import Dict, Any, List
 from fastapi import UploadFile, HTTPException
 from google.cloud import storage
 from google.oauth2 import service_account
+from google.api_core.exceptions import Conflict
 import chromadb
 from chromadb.config import Settings
-import docx
+from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+import zipfile
+from lxml import etree
+import pypdfium2 as pdfium
 from PyPDF2 import PdfReader
 from pylatexenc.latex2text import LatexNodes2Text
 import uuid
+from hashlib import blake2b
+from array import array
 import tempfile
+import mimetypes
 import re
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import bindparam, make_url, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from datetime import datetime
+from cachetools import LRUCache, TTLCache
 
 logger = logging.getLogger(__name__)
 
+JSON_HEADERS = {'Content-Type': 'application/json'}
+ALLOWED_FILE_TYPES = frozenset({'pdf', 'docx', 'tex'})
+DOCUMENTS_PAGE_SIZE = 100
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", 50 * 1024 * 1024))  # bytes
+CHROMA_BATCH_SIZE = 200  # Chunks per collection.add() request
+CHROMA_MAX_CONCURRENT_ADDS = int(os.getenv("CHROMA_MAX_CONCURRENT_ADDS", 4))  # Batches in flight per document
+CHROMA_INITIAL_BACKOFF = 0.5  # Seconds, doubled after each quota error
+PDF_PAGES_PER_TASK = 50  # Pages per worker task when extracting long PDFs
+MIN_CHUNK_SIZE = 32  # Shortest chunk (stripped, in characters) worth embedding
+BLANK_LINES = re.compile(r'\n{3,}')
+DOCX_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+DOCX_BODY = f'{DOCX_NS}body'
+DOCX_PARAGRAPH = f'{DOCX_NS}p'
+DOCX_RUN = f'{DOCX_NS}r'
+DOCX_HYPERLINK = f'{DOCX_NS}hyperlink'
+DOCX_TEXT = f'{DOCX_NS}t'
+DOCX_SPECIAL_CHARS = {f'{DOCX_NS}tab': '\t', f'{DOCX_NS}br': '\n', f'{DOCX_NS}cr': '\n'}
+# Built once per process; converting doesn't change its state
+LATEX_TO_TEXT = LatexNodes2Text()
+# Where uploads are staged; point it at a tmpfs (e.g. /dev/shm, if it's big enough) to keep them off the disk
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR") or tempfile.gettempdir()
+
 def split_text_into_chunks(text: str, max_chunk_size: int = 3000) -> List[str]:
     """Split text into chunks of approximately max_chunk_size bytes."""
-    # First split by paragraphs
-    paragraphs = text.split('\n\n')
+    # Walk the paragraphs of the encoded text and cut chunks as byte slices
+    data = text.encode('utf-8')
+    if len(data) <= max_chunk_size:
+        return [text]
     chunks = []
-    current_chunk = []
+    chunk_start = 0
     current_size = 0
+    pos = 0
     
-    for para in paragraphs:
-        para_size = len(para.encode('utf-8'))
-        if current_size + para_size > max_chunk_size and current_chunk:
-            # Join current chunk and add to chunks
-            chunks.append('\n\n'.join(current_chunk))
-            current_chunk = [para]
+    while True:
+        end = data.find(b'\n\n', pos)
+        if end == -1:
+            end = len(data)
+        para_size = end - pos
+        if current_size + para_size > max_chunk_size and pos > chunk_start:
+            # Close the current chunk before this paragraph (dropping the separator)
+            chunks.append(data[chunk_start:pos - 2].decode('utf-8'))
+            chunk_start = pos
             current_size = para_size
         else:
-            current_chunk.append(para)
             current_size += para_size
+        if end == len(data):
+            break
+        pos = end + 2
     
-    # Add the last chunk if it exists
-    if current_chunk:
-        chunks.append('\n\n'.join(current_chunk))
+    # Add the last chunk
+    chunks.append(data[chunk_start:].decode('utf-8'))
     
     return chunks
 
+def _extract_docx_text(file_path: str) -> str:
+    # Stream word/document.xml instead of building python-docx Paragraph objects;
+    # like doc.paragraphs, only top-level body paragraphs are included
+    paragraphs = []
+    with zipfile.ZipFile(file_path) as archive, archive.open('word/document.xml') as xml:
+        for _, paragraph in etree.iterparse(xml, events=('end',), tag=DOCX_PARAGRAPH):
+            if paragraph.getparent().tag != DOCX_BODY:
+                continue
+            # Only run content counts: not the tab stops under w:pPr, nor paragraphs nested in text boxes
+            runs = (
+                run
+                for child in paragraph.iterchildren(DOCX_RUN, DOCX_HYPERLINK)
+                for run in (child.iterchildren(DOCX_RUN) if child.tag == DOCX_HYPERLINK else (child,))
+            )
+            paragraphs.append("".join(
+                node.text or "" if node.tag == DOCX_TEXT else DOCX_SPECIAL_CHARS[node.tag]
+                for run in runs
+                for node in run.iterchildren(DOCX_TEXT, *DOCX_SPECIAL_CHARS)
+            ))
+            paragraph.clear()
+    return "\n".join(paragraphs)
+
+def _copy_and_hash(src, dst, chunk_size: int = 1 << 20) -> str:
+    hasher = blake2b(digest_size=16)
+    while chunk := src.read(chunk_size):
+        hasher.update(chunk)
+        dst.write(chunk)
+    return hasher.hexdigest()
+
+def _unpack_embedding(data: bytes) -> List[float]:
+    # Cached embeddings are stored as packed float32
+    embedding = array('f')
+    embedding.frombytes(data)
+    return embedding.tolist()
+
+def count_pdf_pages(file_path: str) -> int:
+    pdf = pdfium.PdfDocument(file_path)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+def extract_pdf_pages(file_path: str, start: int = 0, end: int = None) -> str:
+    """Extract the text of pages [start, end) with pdfium."""
+    pdf = pdfium.PdfDocument(file_path)
+    try:
+        end = len(pdf) if end is None else end
+        # pdfium ends lines with \r\n; normalise so paragraph splitting sees plain newlines
+        return "\n".join(pdf[i].get_textpage().get_text_bounded().replace("\r\n", "\n") for i in range(start, end))
+    finally:
+        pdf.close()
+
+def extract_text(file_path: str, file_type: str) -> str:
+    """Extract plain text from a document; runs in the processor's worker pool."""
+    if file_type == 'pdf':
+        try:
+            text = extract_pdf_pages(file_path)
+        except Exception as e:
+            logger.warning(f"pdfium failed to extract text, falling back to PyPDF2: {str(e)}")
+            reader = PdfReader(file_path)
+            text = "\n".join(page.extract_text() or "" for page in reader.pages)
+    elif file_type == 'docx':
+        text = _extract_docx_text(file_path)
+    else:  # tex
+        with open(file_path, 'rb') as f:
+            latex_content = f.read().decode('utf-8', errors='replace')
+        text = LATEX_TO_TEXT.latex_to_text(latex_content)
+    return text
+
 class DocumentProcessor:
     def __init__(self):
         # Initialize database connection
@@ -52,8 +161,18 @@ class DocumentProcessor:
         if not database_url:
             raise ValueError("DATABASE_URL environment variable is not set")
         
-        self.engine = create_engine(database_url)
-        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        # Async engine (asyncpg) so queries don't block the event loop
+        self.engine = create_async_engine(
+            make_url(database_url).set(drivername="postgresql+asyncpg"),
+            pool_size=20,
+            max_overflow=40,
+            pool_pre_ping=True,
+            pool_recycle=1800,
+            pool_use_lifo=True
+        )
+        self.SessionLocal = async_sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        # Lookups need no transaction; same pool, autocommit connections
+        self.ReadSession = async_sessionmaker(bind=self.engine.execution_options(isolation_level="AUTOCOMMIT"))
         
         # Initialize GCS client with credentials
         credentials_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "/app/credentials/service-account.json")
@@ -65,7 +184,7 @@ class DocumentProcessor:
             # Use credentials from environment variable
             logger.info("Using credentials from GOOGLE_CREDENTIALS env var")
             credentials = service_account.Credentials.from_service_account_info(
-                json.loads(credentials_json)
+                orjson.loads(credentials_json)
             )
         elif credentials_path:
             # Use credentials from file
@@ -79,65 +198,93 @@ class DocumentProcessor:
         self.gcs_client = storage.Client(credentials=credentials)
         self.bucket_name = os.getenv("GOOGLE_CLOUD_BUCKET_NAME")
         
-        # Create bucket if it doesn't exist
-        try:
-            self.bucket = self.gcs_client.get_bucket(self.bucket_name)
-            logger.info(f"Using existing bucket: {self.bucket_name}")
-        except Exception as e:
-            logger.info(f"Bucket {self.bucket_name} does not exist, creating it...")
-            self.bucket = self.gcs_client.create_bucket(self.bucket_name)
-            logger.info(f"Created bucket: {self.bucket_name}")
+        # Bucket handle without a network call; existence is checked on first upload
+        self.bucket = self.gcs_client.bucket(self.bucket_name)
+        self._bucket_checked = False
+        
+        # Short-lived read caches, invalidated by this processor's own writes
+        self._user_documents_cache = TTLCache(maxsize=1024, ttl=30)  # user_id -> {(limit, offset): page}
+        self._document_cache = TTLCache(maxsize=1024, ttl=30)
+        self._chunks_cache = TTLCache(maxsize=512, ttl=60)
+        self._upload_cache = LRUCache(maxsize=1024)  # (user_id, content digest) -> upload result
         
-        # Initialize ChromaDB client (optional)
+        # Text extraction is CPU-bound, so it runs in worker processes
+        # (spawned, since forking the threaded server process isn't safe)
+        self._pool = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context("spawn"))
+        
+        # ChromaDB client (optional), connected on app startup by init_chroma()
+        self.chroma_client = None
         self.collection = None
+        # Chunks are embedded here, in a thread, rather than by the client inside collection.add(),
+        # which would run the model on the event loop
+        self.embedding_function = DefaultEmbeddingFunction()
+
+    async def init_chroma(self):
+        """Connect the async ChromaDB client; documents are still stored without it."""
         try:
             logger.info("Initializing ChromaDB client...")
-            try:
-                self.chroma_client = chromadb.HttpClient(
-                    host='api.trychroma.com',
-                    port=8000,
-                    ssl=True,
-                    tenant=os.getenv("CHROMA_TENANT"),
-                    database=os.getenv("CHROMA_DATABASE"),
-                    headers={
-                        'x-chroma-token': os.getenv("CHROMA_API_KEY")
-                    }
-                )
-                logger.info("ChromaDB client initialized successfully")
-                
-                logger.info("Getting or creating 'documents' collection...")
-                self.collection = self.chroma_client.get_or_create_collection("documents")
-                logger.info("Collection initialized successfully")
-            except Exception as e:
-                logger.error(f"Error initializing ChromaDB: {str(e)}", exc_info=True)
-                logger.warning("Continuing without ChromaDB functionality")
-                self.chroma_client = None
-                self.collection = None
+            self.chroma_client = await chromadb.AsyncHttpClient(
+                host='api.trychroma.com',
+                port=8000,
+                ssl=True,
+                tenant=os.getenv("CHROMA_TENANT"),
+                database=os.getenv("CHROMA_DATABASE"),
+                headers={
+                    'x-chroma-token': os.getenv("CHROMA_API_KEY")
+                }
+            )
+            logger.info("ChromaDB client initialized successfully")
+            
+            logger.info("Getting or creating 'documents' collection...")
+            self.collection = await self.chroma_client.get_or_create_collection("documents", embedding_function=self.embedding_function)
+            logger.info("Collection initialized successfully")
         except Exception as e:
             logger.error(f"Error initializing ChromaDB: {str(e)}", exc_info=True)
             logger.warning("Continuing without ChromaDB functionality")
+            self.chroma_client = None
+            self.collection = None
 
     async def process_document(self, file: UploadFile, user_id: str) -> Dict[str, Any]:
-        file_id = str(uuid.uuid4())
-        file_ext = file.filename.split('.')[-1].lower()
+        file_id = uuid.uuid4().hex
+        file_ext = os.path.splitext(file.filename)[1][1:].lower()
         
         # Validate file type
-        if file_ext not in ['pdf', 'docx', 'tex']:
+        if file_ext not in ALLOWED_FILE_TYPES:
             raise HTTPException(status_code=400, detail="Unsupported file type")
+        if file.size and file.size > MAX_UPLOAD_SIZE:
+            raise HTTPException(status_code=413, detail="File too large")
         
         # Save file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_ext}") as temp_file:
-            content = await file.read()
-            temp_file.write(content)
+        with tempfile.NamedTemporaryFile(delete=True, dir=UPLOAD_TMP_DIR, suffix=f".{file_ext}") as temp_file:
+            # Copy in 1 MiB chunks rather than reading the whole upload into memory,
+            # fingerprinting the content on the way
+            content_digest = await asyncio.to_thread(_copy_and_hash, file.file, temp_file)
             temp_file.flush()
             
-            # Upload to GCS
-            blob_name = f"documents/{file_id}/{file.filename}"
-            blob = self.bucket.blob(blob_name)
-            blob.upload_from_filename(temp_file.name)
+            # The same user uploading the same bytes again gets the stored document back
+            cached_result = self._upload_cache.get((user_id, content_digest))
+            if cached_result:
+                # The cache is per process, so another worker may have deleted or renamed the document since
+                async with self.SessionLocal() as db:
+                    filename = (await db.execute(
+                        text("SELECT filename FROM documents WHERE id = :document_id"),
+                        {"document_id": cached_result["id"]}
+                    )).scalar()
+                if filename is not None:
+                    logger.info(f"Upload matches already processed document {cached_result['id']}")
+                    return {**cached_result, "filename": filename}
+                self._upload_cache.pop((user_id, content_digest), None)
             
-            # Extract text based on file type
-            text = self._extract_text(temp_file.name, file_ext)
+            # Upload to GCS while extracting text based on file type
+            await self._ensure_bucket()
+            blob_name = f"documents/{file_id}/{file.filename}"
+            blob = self.bucket.blob(blob_name, chunk_size=8 << 20)  # Resumable upload in 8 MiB parts
+            content_type = mimetypes.guess_type(file.filename)[0]
+            _, document_text = await asyncio.gather(
+                # Upload from the open handle instead of reopening the path
+                asyncio.to_thread(blob.upload_from_file, temp_file, rewind=True, content_type=content_type),
+                self._extract_text(temp_file.name, file_ext)
+            )
             
             # Store in ChromaDB if available
             chroma_status = "skipped"
@@ -146,42 +293,71 @@ class DocumentProcessor:
             
             if self.collection:
                 # Split text into chunks
-                chunks = split_text_into_chunks(text)
-                total_chunks = len(chunks)
-                logger.info(f"Split document into {total_chunks} chunks")
+                # Collapse runs of blank lines, then drop chunks too small to be worth embedding
+                chunks = split_text_into_chunks(BLANK_LINES.sub('\n\n', document_text))
+                chunks = [chunk for chunk in chunks if len(chunk.strip()) >= MIN_CHUNK_SIZE]
                 
-                # Store each chunk with metadata
-                chunk_ids = []
+                # Store repeated chunks (boilerplate, preambles) once, listing the copies on it
+                unique_chunks = {}  # digest -> (chunk_index, duplicate chunk ids)
                 for i, chunk in enumerate(chunks):
-                    chunk_id = f"{file_id}_chunk_{i}"
-                    chunk_ids.append(chunk_id)
-                    
-                    metadata = {
-                        "f": file.filename,  # filename
-                        "t": file_ext,       # type
-                        "d": file_id,        # document_id
-                        "c": chunk_id,       # chunk_id
-                        "i": i,              # chunk_index
-                        "n": total_chunks,   # total_chunks
-                        "u": user_id         # user_id
-                    }
-                    
-                    try:
-                        self.collection.add(
-                            documents=[chunk],
-                            ids=[chunk_id],
-                            metadatas=[metadata]
+                    digest = blake2b(chunk.encode('utf-8'), digest_size=16).digest()
+                    if digest in unique_chunks:
+                        unique_chunks[digest][1].append(f"{file_id}_chunk_{i}")
+                    else:
+                        unique_chunks[digest] = (i, [])
+                total_chunks = len(unique_chunks)
+                logger.info(f"Split document into {len(chunks)} chunks ({total_chunks} unique)")
+                
+                # Store the chunks with metadata, a batch per request
+                chunk_indexes = [i for i, _ in unique_chunks.values()]
+                documents = [chunks[i] for i in chunk_indexes]
+                chunk_ids = [f"{file_id}_chunk_{i}" for i in chunk_indexes]
+                base_metadata = {
+                    "f": file.filename,  # filename
+                    "t": file_ext,       # type
+                    "d": file_id,        # document_id
+                    "n": total_chunks,   # total_chunks
+                    "u": user_id         # user_id
+                }
+                metadatas = [
+                    {**base_metadata, "c": chunk_id, "i": i}  # chunk_id, chunk_index
+                    for i, chunk_id in zip(chunk_indexes, chunk_ids)
+                ]
+                for metadata, (_, duplicate_ids) in zip(metadatas, unique_chunks.values()):
+                    if duplicate_ids:
+                        metadata["a"] = ",".join(duplicate_ids)  # alias chunk ids
+                
+                # Chunks embedded before (by content hash) reuse their cached embedding; the rest are
+                # embedded here and saved to the cache
+                chunk_hashes = [digest.hex() for digest in unique_chunks]
+                embeddings = await self._get_cached_embeddings(chunk_hashes)
+                logger.info(f"{len(embeddings)}/{total_chunks} chunk embeddings found in cache")
+                new_embeddings = {}
+                
+                semaphore = asyncio.Semaphore(CHROMA_MAX_CONCURRENT_ADDS)
+                
+                async def add_batch(indexes):
+                    async with semaphore:
+                        misses = [j for j in indexes if chunk_hashes[j] not in embeddings]
+                        if misses:
+                            vectors = await asyncio.to_thread(self.embedding_function, [documents[j] for j in misses])
+                            new_embeddings.update(zip((chunk_hashes[j] for j in misses), vectors))
+                        return await self._add_chunks(
+                            [documents[j] for j in indexes],
+                            [chunk_ids[j] for j in indexes],
+                            [metadatas[j] for j in indexes],
+                            [embeddings.get(chunk_hashes[j], new_embeddings.get(chunk_hashes[j])) for j in indexes]
                         )
-                        chunks_processed += 1
-                        logger.info(f"Successfully stored chunk {i+1}/{total_chunks}")
-                    except Exception as e:
-                        error_msg = str(e)
-                        if "Quota exceeded" in error_msg or "429" in error_msg:
-                            logger.warning(f"ChromaDB quota exceeded for chunk {chunk_id}. Stopping chunk processing.")
-                            break
-                        else:
-                            logger.error(f"Error storing chunk in ChromaDB: {error_msg}", exc_info=True)
-                            continue
+                
+                results = await asyncio.gather(*(
+                    add_batch(range(start, min(start + CHROMA_BATCH_SIZE, total_chunks)))
+                    for start in range(0, total_chunks, CHROMA_BATCH_SIZE)
+                ))
+                chunks_processed = sum(results)
+                
+                await self._cache_embeddings(new_embeddings)
+                
+                logger.info(f"Stored {chunks_processed}/{total_chunks} chunks in ChromaDB")
                 
                 if chunks_processed == total_chunks:
                     chroma_status = "processed"
@@ -191,8 +367,8 @@ class DocumentProcessor:
                     chroma_status = "quota_exceeded"
             
             # Store document metadata in database
-            with self.SessionLocal() as db:
-                db.execute(
+            async with self.SessionLocal() as db:
+                await db.execute(
                     text("""
                         INSERT INTO documents (
                             id, user_id, filename, file_type, gcs_path, 
@@ -210,7 +386,7 @@ class DocumentProcessor:
                         "filename": file.filename,
                         "file_type": file_ext,
                         "gcs_path": blob_name,
-                        "fulltext_content": text,
+                        "fulltext_content": document_text,
                         "chroma_status": chroma_status,
                         "chunks_processed": chunks_processed,
                         "total_chunks": total_chunks,
@@ -218,9 +394,10 @@ class DocumentProcessor:
                         "updated_at": datetime.utcnow()
                     }
                 )
-                db.commit()
+                await db.commit()
+            self._invalidate_cache(user_id)
             
-            return {
+            result = {
                 "id": file_id,
                 "filename": file.filename,
                 "gcs_path": blob_name,
@@ -229,11 +406,133 @@ class DocumentProcessor:
                 "chunks_processed": chunks_processed,
                 "total_chunks": total_chunks
             }
+            # Only fully indexed documents are reused; anything else is retried on the next upload
+            if chroma_status == "processed":
+                self._upload_cache[(user_id, content_digest)] = result
+            return result
 
-    async def get_user_documents(self, user_id: str) -> List[Dict[str, Any]]:
-        """Get all documents for a given user."""
-        with self.SessionLocal() as db:
-            result = db.execute(
+    async def close(self):
+        self._pool.shutdown(cancel_futures=True)
+        await self.engine.dispose()
+
+    async def _extract_text(self, file_path: str, file_type: str) -> str:
+        """Extract text in the worker pool, sharding long PDFs across workers by page range."""
+        loop = asyncio.get_running_loop()
+        if file_type == 'pdf':
+            try:
+                page_count = await loop.run_in_executor(self._pool, count_pdf_pages, file_path)
+                if page_count > PDF_PAGES_PER_TASK:
+                    parts = await asyncio.gather(*(
+                        loop.run_in_executor(self._pool, extract_pdf_pages, file_path, start, min(start + PDF_PAGES_PER_TASK, page_count))
+                        for start in range(0, page_count, PDF_PAGES_PER_TASK)
+                    ))
+                    # Shards already have normalised line endings; keep the page break between them
+                    return "\n".join(parts)
+            except Exception as e:
+                # extract_text below falls back to PyPDF2 if pdfium can't read the file
+                logger.warning(f"Sharded PDF extraction failed: {str(e)}")
+        return await loop.run_in_executor(self._pool, extract_text, file_path, file_type)
+
+    def _invalidate_cache(self, user_id: str, document_id: str = None):
+        self._user_documents_cache.pop(user_id, None)
+        if document_id:
+            self._document_cache.pop(document_id, None)
+            self._chunks_cache.pop(document_id, None)
+            for key, result in list(self._upload_cache.items()):
+                if result["id"] == document_id:
+                    del self._upload_cache[key]
+
+    async def _ensure_bucket(self):
+        """Create the bucket if it doesn't exist yet (once per process)."""
+        if self._bucket_checked:
+            return
+        if await asyncio.to_thread(self.bucket.exists):
+            logger.info(f"Using existing bucket: {self.bucket_name}")
+        else:
+            logger.info(f"Bucket {self.bucket_name} does not exist, creating it...")
+            try:
+                self.bucket = await asyncio.to_thread(self.gcs_client.create_bucket, self.bucket_name)
+                logger.info(f"Created bucket: {self.bucket_name}")
+            except Conflict:
+                # Created concurrently by another request or replica
+                logger.info(f"Bucket {self.bucket_name} already created")
+        self._bucket_checked = True
+
+    async def _get_cached_embeddings(self, chunk_hashes: List[str]) -> Dict[str, List[float]]:
+        """Look up previously computed embeddings by chunk content hash."""
+        if not chunk_hashes:
+            return {}
+        try:
+            async with self.SessionLocal() as db:
+                result = await db.execute(
+                    text("SELECT hash, embedding FROM chunk_embeddings WHERE hash IN :hashes")
+                        .bindparams(bindparam("hashes", expanding=True)),
+                    {"hashes": chunk_hashes}
+                )
+                return {row.hash: _unpack_embedding(row.embedding) for row in result}
+        except Exception as e:
+            logger.error(f"Error reading embedding cache: {str(e)}", exc_info=True)
+            return {}
+
+    async def _cache_embeddings(self, embeddings: Dict[str, List[float]]):
+        """Save newly computed embeddings by chunk content hash."""
+        if not embeddings:
+            return
+        try:
+            rows = [
+                {"hash": chunk_hash, "embedding": array('f', embedding).tobytes()}
+                for chunk_hash, embedding in embeddings.items()
+            ]
+            async with self.SessionLocal() as db:
+                await db.execute(
+                    text("INSERT INTO chunk_embeddings (hash, embedding) VALUES (:hash, :embedding) ON CONFLICT (hash) DO NOTHING"),
+                    rows
+                )
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Error writing embedding cache: {str(e)}", exc_info=True)
+
+    async def _add_chunks(self, documents: List[str], ids: List[str], metadatas: List[Dict[str, Any]], embeddings: List[List[float]] = None) -> int:
+        """Add chunks to ChromaDB, backing off with smaller batches on quota errors. Returns how many were stored."""
+        stored = 0
+        batch_size = len(ids)
+        backoff = CHROMA_INITIAL_BACKOFF
+        start = 0
+        while start < len(ids):
+            end = min(start + batch_size, len(ids))
+            try:
+                await self.collection.add(
+                    documents=documents[start:end],
+                    ids=ids[start:end],
+                    metadatas=metadatas[start:end],
+                    embeddings=embeddings[start:end] if embeddings else None
+                )
+                stored += end - start
+                start = end
+            except Exception as e:
+                error_msg = str(e)
+                if "Quota exceeded" in error_msg or "429" in error_msg:
+                    if batch_size > 1:
+                        # Retry the same chunks in smaller batches after a pause
+                        batch_size = max(1, batch_size // 2)
+                        logger.warning(f"ChromaDB quota exceeded, retrying with batches of {batch_size} in {backoff}s")
+                        await asyncio.sleep(backoff)
+                        backoff *= 2
+                        continue
+                    logger.warning(f"ChromaDB quota exceeded for chunk {ids[start]}. Stopping chunk processing.")
+                    break
+                else:
+                    logger.error(f"Error storing chunks {ids[start]}..{ids[end - 1]} in ChromaDB: {error_msg}", exc_info=True)
+                    start = end
+        return stored
+
+    async def get_user_documents(self, user_id: str, limit: int = DOCUMENTS_PAGE_SIZE, offset: int = 0) -> List[Dict[str, Any]]:
+        """Get a page of documents for a given user, newest first."""
+        pages = self._user_documents_cache.get(user_id)
+        if pages is not None and (limit, offset) in pages:
+            return pages[(limit, offset)]
+        async with self.ReadSession() as db:
+            result = await db.execute(
                 text("""
                     SELECT 
                         id, filename, file_type, gcs_path, chroma_status,
@@ -241,30 +540,30 @@ class DocumentProcessor:
                     FROM documents
                     WHERE user_id = :user_id
                     ORDER BY created_at DESC
+                    LIMIT :limit OFFSET :offset
                 """),
-                {"user_id": user_id}
+                {"user_id": user_id, "limit": limit, "offset": offset}
             )
             
-            documents = []
-            for row in result:
-                documents.append({
-                    "id": row.id,
-                    "filename": row.filename,
-                    "file_type": row.file_type,
-                    "gcs_path": row.gcs_path,
-                    "chroma_status": row.chroma_status,
-                    "chunks_processed": row.chunks_processed,
-                    "total_chunks": row.total_chunks,
-                    "created_at": row.created_at.isoformat(),
-                    "updated_at": row.updated_at.isoformat()
-                })
+            documents = [
+                {
+                    **row,
+                    "created_at": row["created_at"].isoformat(),
+                    "updated_at": row["updated_at"].isoformat()
+                }
+                for row in result.mappings()
+            ]
             
+            self._user_documents_cache.setdefault(user_id, {})[(limit, offset)] = documents
             return documents
 
     async def get_document_by_id(self, document_id: str) -> Dict[str, Any]:
         """Get a document by ID."""
-        with self.SessionLocal() as db:
-            result = db.execute(
+        cached = self._document_cache.get(document_id)
+        if cached is not None:
+            return cached
+        async with self.ReadSession() as db:
+            result = (await db.execute(
                 text("""
                     SELECT 
                         id, user_id, filename, file_type, gcs_path, 
@@ -274,52 +573,56 @@ class DocumentProcessor:
                     WHERE id = :document_id
                 """),
                 {"document_id": document_id}
-            ).first()
+            )).first()
             
             if not result:
                 return None
                 
             # Get chunks from ChromaDB if available
-            chunks = []
-            if self.collection:
-                try:
-                    chroma_results = self.collection.get(
-                        where={"document_id": document_id},
-                        include=["documents", "metadatas"]
-                    )
-                    if chroma_results and chroma_results['ids']:
-                        for i, chunk_id in enumerate(chroma_results['ids']):
-                            chunks.append({
-                                "id": chunk_id,
-                                "content": chroma_results['documents'][i],
-                                "metadata": chroma_results['metadatas'][i]
-                            })
-                except Exception as e:
-                    logger.error(f"Error retrieving chunks from ChromaDB: {str(e)}", exc_info=True)
+            chunks = await self._get_chunks(document_id)
             
-            return {
-                "id": result.id,
-                "user_id": result.user_id,
-                "filename": result.filename,
-                "file_type": result.file_type,
-                "gcs_path": result.gcs_path,
-                "fulltext_content": result.fulltext_content,
-                "chroma_status": result.chroma_status,
-                "chunks_processed": result.chunks_processed,
-                "total_chunks": result.total_chunks,
+            document = {
+                **result._mapping,
                 "created_at": result.created_at.isoformat(),
                 "updated_at": result.updated_at.isoformat(),
                 "chunks": chunks
             }
+            self._document_cache[document_id] = document
+            return document
+
+    async def _get_chunks(self, document_id: str) -> List[Dict[str, Any]]:
+        """Get a document's chunks from ChromaDB (cached; chunks never change after upload)."""
+        if not self.collection:
+            return []
+        cached = self._chunks_cache.get(document_id)
+        if cached is not None:
+            return cached
+        chunks = []
+        try:
+            chroma_results = await self.collection.get(
+                where={"d": document_id},  # document_id
+                include=["documents", "metadatas"]
+            )
+            if chroma_results and chroma_results['ids']:
+                for i, chunk_id in enumerate(chroma_results['ids']):
+                    chunks.append({
+                        "id": chunk_id,
+                        "content": chroma_results['documents'][i],
+                        "metadata": chroma_results['metadatas'][i]
+                    })
+            self._chunks_cache[document_id] = chunks
+        except Exception as e:
+            logger.error(f"Error retrieving chunks from ChromaDB: {str(e)}", exc_info=True)
+        return chunks
 
     async def update_document(self, document_id: str, updates: Dict[str, Any]) -> Dict[str, Any]:
         """Update a document's metadata."""
-        with self.SessionLocal() as db:
+        async with self.SessionLocal() as db:
             # First check if document exists
-            result = db.execute(
-                text("SELECT id FROM documents WHERE id = :document_id"),
+            result = (await db.execute(
+                text("SELECT id, user_id FROM documents WHERE id = :document_id"),
                 {"document_id": document_id}
-            ).first()
+            )).first()
             
             if not result:
                 return None
@@ -348,7 +651,7 @@ class DocumentProcessor:
             update_fields.append("updated_at = now()")
             
             # Execute update
-            db.execute(
+            await db.execute(
                 text(f"""
                     UPDATE documents 
                     SET {', '.join(update_fields)}
@@ -356,22 +659,23 @@ class DocumentProcessor:
                 """),
                 params
             )
-            db.commit()
+            await db.commit()
+            self._invalidate_cache(result.user_id, document_id)
             
             return await self.get_document_by_id(document_id)
 
     async def delete_document(self, document_id: str) -> bool:
         """Delete a document and its associated data."""
-        with self.SessionLocal() as db:
+        async with self.SessionLocal() as db:
             # First check if document exists
-            result = db.execute(
+            result = (await db.execute(
                 text("""
                     SELECT gcs_path, user_id 
                     FROM documents 
                     WHERE id = :document_id
                 """),
                 {"document_id": document_id}
-            ).first()
+            )).first()
             
             if not result:
                 return False
@@ -379,65 +683,38 @@ class DocumentProcessor:
             try:
                 # Delete from GCS
                 blob = self.bucket.blob(result.gcs_path)
-                blob.delete()
+                await asyncio.to_thread(blob.delete)
                 
                 # Delete chunks from ChromaDB if available
                 if self.collection:
                     try:
-                        self.collection.delete(
-                            where={"document_id": document_id}
+                        await self.collection.delete(
+                            where={"d": document_id}  # document_id
                         )
                     except Exception as e:
                         logger.error(f"Error deleting chunks from ChromaDB: {str(e)}", exc_info=True)
                 
                 # Delete from database
-                db.execute(
+                await db.execute(
                     text("DELETE FROM documents WHERE id = :document_id"),
                     {"document_id": document_id}
                 )
-                db.commit()
+                await db.commit()
+                self._invalidate_cache(result.user_id, document_id)
                 
                 return True
             except Exception as e:
                 logger.error(f"Error deleting document: {str(e)}", exc_info=True)
-                db.rollback()
+                await db.rollback()
                 return False
 
-    def _extract_text(self, file_path: str, file_type: str) -> str:
-        if file_type == 'pdf':
-            reader = PdfReader(file_path)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text()
-        elif file_type == 'docx':
-            doc = docx.Document(file_path)
-            text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-        else:  # tex
-            with open(file_path, 'r', encoding='utf-8') as f:
-                latex_content = f.read()
-                text = LatexNodes2Text().latex_to_text(latex_content)
-        return text
-
 class MastraAPI:
-    def __init__(self):
+    def __init__(self, session: aiohttp.ClientSession):
         self.base_url = os.getenv("MASTRA_API_URL", "http://localhost:3001")
-        self.session = None
+        self.session = session
         logger.info(f"Initialized MastraAPI with base URL: {self.base_url}")
 
-    async def ensure_session(self):
-        if not self.session:
-            logger.info("Creating new aiohttp session")
-            self.session = aiohttp.ClientSession()
-        return self.session
-
-    async def close(self):
-        if self.session:
-            logger.info("Closing aiohttp session")
-            await self.session.close()
-            self.session = None
-
     async def send_message(self, message): 
-        session = await self.ensure_session()
         url = f"{self.base_url}/api/agents/memeticMarketingAgent/generate"
         payload = {
             "messages": [
@@ -448,21 +725,22 @@ class MastraAPI:
             ]
         }
         logger.info(f"Sending message to {url}")
-        logger.debug(f"Request payload: {json.dumps(payload, indent=2)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Request payload: {orjson.dumps(payload, option=orjson.OPT_INDENT_2).decode()}")
         
         try:
-            async with session.post(url, json=payload) as response:
-                response_data = await response.json()
+            async with self.session.post(url, data=orjson.dumps(payload), headers=JSON_HEADERS) as response:
+                response_data = await response.json(loads=orjson.loads)
                 logger.info(f"Response status: {response.status}")
-                logger.debug(f"Response headers: {dict(response.headers)}")
-                logger.debug(f"Response data: {json.dumps(response_data, indent=2)}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"Response headers: {dict(response.headers)}")
+                    logger.debug(f"Response data: {orjson.dumps(response_data, option=orjson.OPT_INDENT_2).decode()}")
                 return response_data
         except Exception as e:
             logger.error(f"Error in send_message: {e}", exc_info=True)
             raise
 
     async def trigger_transcript_workflow(self, text: str, timestamp: int, stream_key: str):
-        session = await self.ensure_session()
         url = f"{self.base_url}/api/workflows/transcript"
         payload = {
             "text": text,
@@ -470,13 +748,15 @@ class MastraAPI:
             "stream_key": stream_key
         }
         logger.info(f"Triggering transcript workflow at {url}")
-        logger.debug(f"Workflow payload: {json.dumps(payload, indent=2)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Workflow payload: {orjson.dumps(payload, option=orjson.OPT_INDENT_2).decode()}")
         
         try:
-            async with session.post(url, json=payload) as response:
-                response_data = await response.json()
+            async with self.session.post(url, data=orjson.dumps(payload), headers=JSON_HEADERS) as response:
+                response_data = await response.json(loads=orjson.loads)
                 logger.info(f"Workflow response status: {response.status}")
-                logger.debug(f"Workflow response: {json.dumps(response_data, indent=2)}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"Workflow response: {orjson.dumps(response_data, option=orjson.OPT_INDENT_2).decode()}")
                 return response_data
         except Exception as e:
             logger.error(f"Error in trigger_transcript_workflow: {e}", exc_info=True)
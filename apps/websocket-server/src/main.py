@@ -1,16 +1,36 @@
+import asyncio
 import os
-import json
+import orjson
+import msgspec
 import logging
-from typing import List
+import aiohttp
+from typing import Awaitable, Callable, Dict, List, Set, Union
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, HTTPException, APIRouter, Form
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, HTTPException, APIRouter, Form, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from .api import MastraAPI, DocumentProcessor
+from .types import TranscriberMessage, PartialTranscript, FinalTranscript, NamedEntities, SentimentUpdate
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(level=LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
+BROADCAST_SEND_TIMEOUT = 5.0  # Seconds before a stalled client is dropped
+CLIENT_QUEUE_SIZE = 1000  # Outbound messages buffered per client
+
+message_decoder = msgspec.json.Decoder(TranscriberMessage)
+
+frame_encoder = msgspec.json.Encoder()
+
+def encode(obj) -> str:
+    # Clients receive text frames
+    return frame_encoder.encode(obj).decode()
+
+def as_text(data) -> str:
+    return data if isinstance(data, str) else data.decode(errors="replace")
+
 # Initialize document processor
 document_processor = None
 
@@ -24,15 +44,29 @@ async def lifespan(app: FastAPI):
     global document_processor
     try:
         document_processor = DocumentProcessor()
+        await document_processor.init_chroma()
         logger.info("Document processor initialized successfully")
     except Exception as e:
         logger.error(f"Failed to initialize document processor: {e}", exc_info=True)
         document_processor = None
+    # One pooled HTTP session for the app's outbound aiohttp calls
+    logger.info("Creating new aiohttp session")
+    app.state.session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=100, limit_per_host=32, ttl_dns_cache=300, keepalive_timeout=75, enable_cleanup_closed=True),
+        # Fail fast on unreachable hosts; agent generations can still take minutes
+        timeout=aiohttp.ClientTimeout(total=300, connect=5)
+    )
+    app.state.manager = ConnectionManager(MastraAPI(app.state.session))
     yield
     # Cleanup
+    await app.state.manager.close()
+    logger.info("Closing aiohttp session")
+    await app.state.session.close()
+    if document_processor:
+        await document_processor.close()
     document_processor = None
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Enable CORS
 app.add_middleware(
@@ -47,116 +81,146 @@ app.add_middleware(
 main_router = APIRouter(prefix="/api")
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-        self.mastra_api = MastraAPI()
+    def __init__(self, mastra_api: MastraAPI):
+        self.active_connections: Set[WebSocket] = set()
+        # Each client gets an outbound queue drained by its own sender task,
+        # so a slow client only ever backs up its own queue
+        self.outboxes: Dict[WebSocket, asyncio.Queue] = {}
+        self.senders: Dict[WebSocket, asyncio.Task] = {}
+        self.mastra_api = mastra_api
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        self.active_connections.add(websocket)
+        self.outboxes[websocket] = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        self.senders[websocket] = asyncio.create_task(self._sender(websocket))
         logger.info(f"Client connected. Total connections: {len(self.active_connections)}")
 
     async def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        self._remove(websocket)
         logger.info(f"Client disconnected. Total connections: {len(self.active_connections)}")
-        # Close API session when all connections are closed
-        if not self.active_connections:
-            await self.mastra_api.close()
+
+    def _remove(self, websocket: WebSocket):
+        self.active_connections.discard(websocket)  # May already be dropped by its sender
+        self.outboxes.pop(websocket, None)
+        sender = self.senders.pop(websocket, None)
+        if sender and sender is not asyncio.current_task():
+            sender.cancel()
+
+    async def _sender(self, websocket: WebSocket):
+        queue = self.outboxes[websocket]
+        try:
+            while True:
+                message = await queue.get()
+                await asyncio.wait_for(websocket.send_text(message), BROADCAST_SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error broadcasting message: {e!r}")
+            # Drop clients we can no longer send to
+            self._remove(websocket)
+
+    async def close(self):
+        senders = list(self.senders.values())
+        for websocket in list(self.active_connections):
+            self._remove(websocket)
+        await asyncio.gather(*senders, return_exceptions=True)
 
     async def broadcast(self, message: str):
-        # Broadcast to all connected clients
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except Exception as e:
-                logger.error(f"Error broadcasting message: {e}")
+        # Queue for every client; a client that has fallen CLIENT_QUEUE_SIZE behind loses its oldest message
+        for queue in self.outboxes.values():
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(message)
 
     async def handle_named_entities(self, entities: List[dict]):
-        logger.info(f"Handling named entities: {entities}")
-        for entity in entities:
-            try:
-                # Extract entity text and type
-                entity_text = entity.get("text", "")
-                entity_type = entity.get("entity_type", "")
-                logger.info(f"Processing entity: {entity_text} ({entity_type})")
+        logger.debug("Handling named entities: %s", entities)
+        try:
+            # Extract entity text and type
+            mentions = [
+                f"{entity.get('entity_type', '')} '{entity.get('text', '')}'"
+                for entity in entities
+                if entity.get("text") and entity.get("entity_type")
+            ]
+            if not mentions:
+                return
+            
+            # Give the agent context about everything mentioned in one request
+            message = f"Someone mentioned {'; '.join(mentions)} in their stream. Send a tweet about this."
+            logger.debug("Sending to agent: %s", message)
+            
+            response = await self.mastra_api.send_message(message)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Raw agent response: %s", orjson.dumps(response, option=orjson.OPT_INDENT_2).decode())
+            
+            if not response:
+                logger.error("Agent returned empty response")
+                return
                 
-                if entity_text and entity_type:
-                    # Give the agent context about what was mentioned
-                    message = f"Someone mentioned {entity_type} '{entity_text}' in their stream. Send a tweet about this."
-                    logger.info(f"Sending to agent: {message}")
-                    
-                    response = await self.mastra_api.send_message(message)
-                    logger.info(f"Raw agent response: {json.dumps(response, indent=2)}")
-                    
-                    if not response:
-                        logger.error("Agent returned empty response")
-                        continue
-                        
-                    if isinstance(response, dict):
-                        logger.info(f"Agent response structure: {list(response.keys())}")
-                    
-                    logger.info(f"Processed entity: {entity_text} ({entity_type})")
-            except Exception as e:
-                logger.error(f"Error handling entity: {e}", exc_info=True)
+            if isinstance(response, dict):
+                logger.debug("Agent response structure: %s", list(response.keys()))
+            
+            logger.info(f"Processed {len(mentions)} entities")
+        except Exception as e:
+            logger.error(f"Error handling entities: {e}", exc_info=True)
 
     async def handle_final_transcript(self, text: str, timestamp: int, stream_key: str):
         try:
             # Trigger the transcript workflow
             response = await self.mastra_api.trigger_transcript_workflow(text, timestamp, stream_key)
-            logger.info(f"Triggered transcript workflow: {response}")
+            logger.debug("Triggered transcript workflow: %s", response)
         except Exception as e:
             logger.error(f"Error triggering transcript workflow: {e}")
 
-manager = ConnectionManager()
+async def on_transcript(manager: ConnectionManager, message: TranscriberMessage, data) -> str:
+    return encode(PartialTranscript(text=message.text, timestamp=message.timestamp))
+
+async def on_final_transcript(manager: ConnectionManager, message: TranscriberMessage, data) -> str:
+    await manager.handle_final_transcript(message.text, message.timestamp, message.stream_key)
+    return encode(FinalTranscript(text=message.text, timestamp=message.timestamp))
+
+def message_data(message: TranscriberMessage) -> dict:
+    return message.data if isinstance(message.data, dict) else {}
+
+async def on_named_entities(manager: ConnectionManager, message: TranscriberMessage, data) -> str:
+    entities = message_data(message).get("results", [])
+    await manager.handle_named_entities(entities)
+    return encode(NamedEntities(entities=entities, timestamp=message.timestamp))
+
+async def on_sentiment(manager: ConnectionManager, message: TranscriberMessage, data) -> str:
+    return encode(SentimentUpdate(sentiment=message_data(message).get("sentiment", {}), timestamp=message.timestamp))
+
+async def on_passthrough(manager: ConnectionManager, message: TranscriberMessage, data) -> str:
+    return as_text(data)
+
+# Maps an incoming message type to the coroutine that builds its broadcast frame
+MESSAGE_HANDLERS: Dict[str, Callable[[ConnectionManager, TranscriberMessage, Union[bytes, str]], Awaitable[str]]] = {
+    "transcript": on_transcript,
+    "post_final_transcript": on_final_transcript,
+    "named_entity_recognition": on_named_entities,
+    "sentiment": on_sentiment,
+}
 
 @app.websocket("/ws/transcription")
 async def websocket_endpoint(websocket: WebSocket):
+    manager: ConnectionManager = websocket.app.state.manager
     await manager.connect(websocket)
-    print("Connected to transcription websocket")
     try:
         while True:
-            data = await websocket.receive_text()
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            # Binary frames skip the UTF-8 decode; msgspec reads either form
+            data = frame.get("bytes") or frame.get("text") or ""
             try:
-                message = json.loads(data)
-                message_type = message.get("type", "unknown")
-                print(f"Received message: {message}")
-                if message_type == "transcript":
-                    await manager.broadcast(json.dumps({
-                        "type": "partial_transcript",
-                        "text": message.get("text", ""),
-                        "timestamp": message.get("timestamp")
-                    }))
-                elif message_type == "post_final_transcript":
-                    text = message.get("text", "")
-                    timestamp = message.get("timestamp")
-                    stream_key = message.get("stream_key", "unknown")
-                    
-                    await manager.handle_final_transcript(text, timestamp, stream_key)
-                    await manager.broadcast(json.dumps({
-                        "type": "final_transcript",
-                        "text": text,
-                        "timestamp": timestamp
-                    }))
-                elif message_type == "named_entity_recognition":
-                    entities = message.get("data", {}).get("results", [])
-                    await manager.handle_named_entities(entities)
-                    await manager.broadcast(json.dumps({
-                        "type": "named_entities",
-                        "entities": entities,
-                        "timestamp": message.get("timestamp")
-                    }))
-                elif message_type == "sentiment":
-                    await manager.broadcast(json.dumps({
-                        "type": "sentiment",
-                        "sentiment": message.get("data", {}).get("sentiment", {}),
-                        "timestamp": message.get("timestamp")
-                    }))
-                else:
-                    await manager.broadcast(data)
-            except json.JSONDecodeError:
-                await manager.broadcast(data)
+                message = message_decoder.decode(data)
+            except msgspec.DecodeError:
+                await manager.broadcast(as_text(data))
+                continue
+            handler = MESSAGE_HANDLERS.get(message.type, on_passthrough)
+            await manager.broadcast(await handler(manager, message, data))
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        await manager.disconnect(websocket)
 
 @main_router.post("/webhook")
 async def webhook(data: dict):
@@ -188,13 +252,13 @@ async def upload_document(file: UploadFile = File(...), user_id: str = Form(...)
         raise HTTPException(status_code=500, detail=str(e))
 
 @main_router.get("/documents")
-async def get_documents(user_id: str):
-    """Get all documents for a user"""
+async def get_documents(user_id: str, limit: int = Query(100, ge=1, le=500), offset: int = Query(0, ge=0)):
+    """Get a page of documents for a user"""
     processor = get_document_processor()
     if not processor:
         raise HTTPException(status_code=500, detail="Document processor not initialized")
     try:
-        documents = await processor.get_user_documents(user_id)
+        documents = await processor.get_user_documents(user_id, limit, offset)
         return {"documents": documents}
     except Exception as e:
         logger.error(f"Error retrieving documents: {e}", exc_info=True)
@@ -251,4 +315,7 @@ app.include_router(main_router)
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", "8000"))
-    uvicorn.run(app, host="0.0.0.0", port=port) 
\ No newline at end of file
+    # Connections and broadcasts are per process: only raise this once
+    # every client of a stream is routed to the same worker
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    uvicorn.run("src.main:app", host="0.0.0.0", port=port, workers=workers, loop="uvloop", http="httptools")
\ No newline at end of file
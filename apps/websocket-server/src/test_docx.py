@@ -0,0 +1,42 @@
+import os
+import tempfile
+import zipfile
+
+from src.api import _extract_docx_text
+
+DOCUMENT_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">
+  <w:body>
+    <w:p>
+      <w:pPr>
+        <w:tabs>
+          <w:tab w:val="left" w:pos="2880"/>
+          <w:tab w:val="right" w:pos="5760"/>
+        </w:tabs>
+      </w:pPr>
+      <w:r><w:t>Name</w:t></w:r>
+      <w:r><w:tab/><w:t>Value</w:t></w:r>
+      <w:r>
+        <w:drawing><w:txbxContent><w:p><w:r><w:t>Text box</w:t></w:r></w:p></w:txbxContent></w:drawing>
+      </w:r>
+    </w:p>
+    <w:p>
+      <w:hyperlink><w:r><w:t>Second</w:t></w:r></w:hyperlink>
+      <w:r><w:br/><w:t>line</w:t></w:r>
+    </w:p>
+  </w:body>
+</w:document>
+"""
+
+def test_extract_docx_text():
+    # Tab stop definitions and text box paragraphs must not leak into the text
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sample.docx")
+        with zipfile.ZipFile(path, "w") as archive:
+            archive.writestr("word/document.xml", DOCUMENT_XML)
+        text = _extract_docx_text(path)
+    assert text == "Name\tValue\nSecond\nline", repr(text)
+    print("Extracted docx text matches")
+
+if __name__ == "__main__":
+    test_extract_docx_text()
@@ -1,6 +1,6 @@
 from enum import Enum
-from typing import Optional, Union
-from pydantic import BaseModel, Field
+from typing import Any, Optional, Union
+import msgspec
 
 class TranscriptionEventType(str, Enum):
     START = "start"
@@ -12,27 +12,27 @@ class SentimentLabel(str, Enum):
     NEGATIVE = "negative"
     NEUTRAL = "neutral"
 
-class Sentiment(BaseModel):
+class Sentiment(msgspec.Struct):
     score: float
     label: SentimentLabel
 
-class TranscriptionData(BaseModel):
+class TranscriptionData(msgspec.Struct):
     text: Optional[str] = None
     confidence: Optional[float] = None
     is_final: Optional[bool] = None
     transcript: Optional[str] = None
     sentiment: Optional[Sentiment] = None
 
-class TranscriptionEvent(BaseModel):
+class TranscriptionEvent(msgspec.Struct, rename={"stream_id": "streamId"}):
     type: TranscriptionEventType
-    stream_id: str = Field(..., alias="streamId")
+    stream_id: str
     timestamp: float
     data: TranscriptionData
 
-class TranscriptionRequest(BaseModel):
+class TranscriptionRequest(msgspec.Struct):
     event: TranscriptionEvent
 
-class TranscriptionResponse(BaseModel):
+class TranscriptionResponse(msgspec.Struct):
     success: bool
     data: Optional[TranscriptionData] = None
     error: Optional[str] = None
@@ -41,6 +41,31 @@ class WebSocketMessageType(str, Enum):
     TRANSCRIPTION_EVENT = "transcription_event"
     ERROR = "error"
 
-class WebSocketMessage(BaseModel):
+class WebSocketMessage(msgspec.Struct):
     type: WebSocketMessageType
-    payload: Union[TranscriptionEvent, str] 
\ No newline at end of file
+    payload: Union[TranscriptionEvent, str]
+
+class TranscriberMessage(msgspec.Struct):
+    # Frames forwarded by the RTMP server
+    # Loosely typed, as producers don't always send strings/objects here
+    type: str = "unknown"
+    text: Any = ""
+    timestamp: Any = None
+    stream_key: Optional[str] = "unknown"
+    data: Any = {}
+
+class PartialTranscript(msgspec.Struct, tag_field="type", tag="partial_transcript"):
+    text: Optional[str]
+    timestamp: Any
+
+class FinalTranscript(msgspec.Struct, tag_field="type", tag="final_transcript"):
+    text: Optional[str]
+    timestamp: Any
+
+class NamedEntities(msgspec.Struct, tag_field="type", tag="named_entities"):
+    entities: list
+    timestamp: Any
+
+class SentimentUpdate(msgspec.Struct, tag_field="type", tag="sentiment"):
+    sentiment: Any
+    timestamp: Any
@@ -1,27 +1,58 @@
-from fastapi import FastAPI, WebSocket
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import ORJSONResponse
 import logging
-import json
+import orjson
 import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# Transcription log lines, written by a single background task
+log_queue: asyncio.Queue = asyncio.Queue()
+
+def write_log_lines(f, lines):
+    f.writelines(lines)
+    f.flush()
+
+async def transcription_log_writer():
+    # Keep the file open for the process and write whatever has queued up off the event loop
+    with open("transcriptions.log", "a") as f:
+        while True:
+            lines = [await log_queue.get()]
+            while not log_queue.empty():
+                lines.append(log_queue.get_nowait())
+            done = lines[-1] is None  # Sentinel from shutdown
+            if done:
+                lines.pop()
+            await asyncio.to_thread(write_log_lines, f, lines)
+            if done:
+                return
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    writer = asyncio.create_task(transcription_log_writer())
+    yield
+    await log_queue.put(None)
+    await writer
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Store active WebSocket connections
-active_connections = []
+active_connections: set = set()
 
 @app.websocket("/ws/transcription")
 async def transcription_websocket(websocket: WebSocket):
     await websocket.accept()
-    active_connections.append(websocket)
+    active_connections.add(websocket)
     try:
         while True:
-            # Receive transcription data
-            data = await websocket.receive_text()
-            message = json.loads(data)
+            # Receive transcription data; the RTMP server sends binary frames, which skip the UTF-8 decode
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            message = orjson.loads(frame.get("bytes") or frame.get("text"))
             
             # Log transcription
             timestamp = datetime.fromtimestamp(message["timestamp"] / 1000).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
@@ -29,20 +60,25 @@ async def transcription_websocket(websocket: WebSocket):
             logger.info(f"[{timestamp}] [{status}] {message['text']}")
             
             # Write to log file
-            with open("transcriptions.log", "a") as f:
-                f.write(f"[{timestamp}] [{status}] {message['text']}\n")
+            log_queue.put_nowait(f"[{timestamp}] [{status}] {message['text']}\n")
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
     finally:
-        active_connections.remove(websocket)
+        active_connections.discard(websocket)
         await websocket.close()
 
 @app.post("/webhook")
-async def webhook(data: dict):
+async def webhook(request: Request):
+    try:
+        data = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=422, detail="Body must be valid JSON")
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=422, detail="Body must be a JSON object")
     if data.get("event_type") == "stream_start":
         logger.info(f"Stream started: {data.get('stream_key')}")
         logger.info(f"Metadata: {data.get('metadata')}")
-    return JSONResponse(content={"status": "ok"})
+    return {"status": "ok"}
 
 @app.get("/health")
 async def health_check():
@@ -50,4 +86,4 @@ async def health_check():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="uvloop", http="httptools") 
\ No newline at end of file